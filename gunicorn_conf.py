@@ -0,0 +1,40 @@
+"""
+Gunicorn configuration for the RPi Test Strip Analyzer
+
+Usage: gunicorn -c gunicorn_conf.py server:app
+
+A single worker process, because the camera, the PWM pin and the stream state
+can only be owned by one process. Requests run on threads inside it, so a
+streaming client doesn't block captures, analysis or config requests.
+"""
+
+import os
+
+bind = '0.0.0.0:5000'
+
+workers = 1
+worker_class = 'gthread'
+threads = 8  # Each MJPEG viewer and capture progress stream holds a thread while open
+
+# With gthread this is only the worker heartbeat timeout: the master restarts a
+# worker that stops checking in, however long its requests take. It does not
+# limit request length, so don't raise it for slow captures or analysis
+timeout = 120
+graceful_timeout = 10
+
+# The worker updates a heartbeat file every second; keep it in RAM, not on the SD card
+worker_tmp_dir = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+# Import the app in the worker, not the master, so GPIO and camera state
+# are never set up in one process and inherited by another
+preload_app = False
+
+
+def worker_exit(server, worker):
+    """Release the camera and GPIO and write pending config when the worker stops"""
+    import server as app_server
+    
+    app_server.mjpeg_broker.stop()
+    app_server.kill_camera_processes()
+    app_server.flush_config()
+    app_server.cleanup_pwm()
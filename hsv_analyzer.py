@@ -6,8 +6,93 @@ Uses OpenCV to count pixels within HSV threshold ranges for each ROI
 
 import cv2
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+# Try to import Numba for the fused HSV threshold kernel
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+
+# Fixed-point division tables used by OpenCV's 8-bit BGR2HSV conversion
+# (hue range 0-179). Reproducing them keeps the fused kernel below
+# bit-exact with cv2.cvtColor + cv2.inRange.
+HSV_SHIFT = 12
+_SDIV_TABLE = np.zeros(256, dtype=np.int32)
+_HDIV_TABLE = np.zeros(256, dtype=np.int32)
+for _i in range(1, 256):
+    _SDIV_TABLE[_i] = int(np.rint((255 << HSV_SHIFT) / _i))
+    _HDIV_TABLE[_i] = int(np.rint((180 << HSV_SHIFT) / (6.0 * _i)))
+
+
+def _count_hsv_in_range(bgr, lower, upper, check_hue, sdiv_table, hdiv_table):
+    """
+    Count BGR pixels whose HSV value lies within [lower, upper]
+    
+    Fuses cvtColor(BGR2HSV) + inRange + countNonZero into a single pass
+    without allocating the intermediate HSV image or mask. V and S are
+    tested before H is computed, so most rejected pixels exit early, and
+    H is skipped entirely when the hue bounds cover the full range.
+    
+    Args:
+        bgr: Image as uint8 numpy array (H, W, 3) in BGR order
+        lower: Lower HSV bound as int array [H, S, V]
+        upper: Upper HSV bound as int array [H, S, V]
+        check_hue: False if the hue bounds cover the full 0-179 range
+        sdiv_table: Saturation division table (_SDIV_TABLE)
+        hdiv_table: Hue division table (_HDIV_TABLE)
+    
+    Returns:
+        int: Number of pixels within the HSV bounds
+    """
+    hmin, smin, vmin = lower[0], lower[1], lower[2]
+    hmax, smax, vmax = upper[0], upper[1], upper[2]
+    half = 1 << (HSV_SHIFT - 1)
+    count = 0
+    
+    for i in range(bgr.shape[0]):
+        for j in range(bgr.shape[1]):
+            b = np.int32(bgr[i, j, 0])
+            g = np.int32(bgr[i, j, 1])
+            r = np.int32(bgr[i, j, 2])
+            
+            v = max(b, g, r)
+            if v < vmin or v > vmax:
+                continue
+            
+            diff = v - min(b, g, r)
+            s = (diff * sdiv_table[v] + half) >> HSV_SHIFT
+            if s < smin or s > smax:
+                continue
+            
+            if not check_hue:
+                count += 1
+                continue
+            
+            if v == r:
+                h = g - b
+            elif v == g:
+                h = b - r + 2 * diff
+            else:
+                h = r - g + 4 * diff
+            h = (h * hdiv_table[diff] + half) >> HSV_SHIFT
+            if h < 0:
+                h += 180
+            if h < hmin or h > hmax:
+                continue
+            
+            count += 1
+    
+    return count
+
+
+if NUMBA_AVAILABLE:
+    # nogil so concurrent analyses (analyze_3_captures) run in parallel
+    _count_hsv_in_range = njit(cache=True, nogil=True)(_count_hsv_in_range)
+
 
 class HSVAnalyzer:
     """
@@ -52,46 +137,161 @@ class HSVAnalyzer:
     
     # ============================================
     
-    def __init__(self, hsv_lower=None, hsv_upper=None):
+    # cv2.imdecode flags for decode-time downscaling (see the reduce option)
+    REDUCED_DECODE_FLAGS = {
+        1: cv2.IMREAD_COLOR,
+        2: cv2.IMREAD_REDUCED_COLOR_2,
+        4: cv2.IMREAD_REDUCED_COLOR_4,
+        8: cv2.IMREAD_REDUCED_COLOR_8,
+    }
+    
+    # Above this total ROI area (as a multiple of the frame area, e.g. many
+    # overlapping calibration windows) a single full-frame mask plus an
+    # integral image is cheaper than converting every ROI crop separately
+    INTEGRAL_AREA_RATIO = 2.0
+    
+    def __init__(self, hsv_lower=None, hsv_upper=None, use_numba=False, reduce=1,
+                 use_opencl=False):
         """
         Initialize analyzer with custom HSV thresholds
         
         Args:
             hsv_lower: Lower HSV bound as numpy array [H, S, V] or None for default
             hsv_upper: Upper HSV bound as numpy array [H, S, V] or None for default
+            use_numba: Use the fused Numba kernel instead of OpenCV (if installed)
+            reduce: Downscale factor applied while decoding image files (1, 2, 4 or 8).
+                    ROI coordinates stay in original resolution and counts are
+                    scaled back to original-resolution pixels
+            use_opencl: Run cvtColor/inRange through OpenCV's OpenCL (T-API) path
+                        when an OpenCL device is available
         """
-        self.hsv_lower = hsv_lower if hsv_lower is not None else self.HSV_LOWER
-        self.hsv_upper = hsv_upper if hsv_upper is not None else self.HSV_UPPER
+        if reduce not in self.REDUCED_DECODE_FLAGS:
+            raise ValueError(f"reduce must be one of {sorted(self.REDUCED_DECODE_FLAGS)}")
+        self.reduce = reduce
+        
+        hsv_lower = hsv_lower if hsv_lower is not None else self.HSV_LOWER
+        hsv_upper = hsv_upper if hsv_upper is not None else self.HSV_UPPER
+        
+        # Convert bounds once to contiguous uint8 (the HSV image dtype) and
+        # cache plain tuples so cv2.inRange doesn't re-marshal arrays per call
+        self.hsv_lower = np.ascontiguousarray(np.clip(hsv_lower, 0, 255), dtype=np.uint8)
+        self.hsv_upper = np.ascontiguousarray(np.clip(hsv_upper, 0, 255), dtype=np.uint8)
+        self._lower_tuple = tuple(int(v) for v in self.hsv_lower)
+        self._upper_tuple = tuple(int(v) for v in self.hsv_upper)
+        
+        # With the default thresholds the hue bounds cover the whole 0-179
+        # range, so only saturation and value need to be tested
+        self._hue_is_full = bool(self.hsv_lower[0] == 0 and self.hsv_upper[0] >= 179)
+        
+        # OpenCV's SIMD cvtColor + inRange measured faster than the scalar
+        # Numba kernel on capture-sized ROIs, so the kernel is opt-in
+        self.use_numba = use_numba and NUMBA_AVAILABLE
+        
+        # OpenCL is opt-in: most Raspberry Pi OS images have no usable driver.
+        # OpenCV's global switch is only turned on around this analyzer's own
+        # calls (see _count_roi_opencl), other cv2 users are unaffected
+        self.use_opencl = use_opencl and cv2.ocl.haveOpenCL()
+        
+        # Reusable output buffer for save_debug_image
+        self._debug_canvas = None
         
     def analyze_image(self, image_path, rois):
         """
         Analyze image and return pixel counts for each ROI
         
         Args:
-            image_path: Path to image file
-            rois: List of ROI dictionaries with keys: x, y, width, height
+            image_path: Path to image file, or an image already decoded by load_image
+            rois: List of ROI dictionaries with keys: x, y, width, height,
+                  or an (N, 4) int array of [x, y, width, height]
         
         Returns:
             List of pixel counts for each ROI [count1, count2, count3, count4]
         """
-        # Load image
-        img = cv2.imread(str(image_path))
+        if isinstance(image_path, np.ndarray):
+            img = image_path
+        else:
+            img = self._load_image(image_path, self.reduce)
+        
+        if self.reduce == 1:
+            return self.analyze_image_array(img, rois)
+        
+        # Map the ROIs onto the reduced image, then scale the counts back up
+        # so they stay comparable with full-resolution results
+        roi_array = self._roi_list_to_array(rois)
+        starts = roi_array[:, :2] // self.reduce
+        ends = (roi_array[:, :2] + roi_array[:, 2:]) // self.reduce
+        reduced_rois = np.hstack([starts, ends - starts])
+        
+        counts = self.analyze_image_array(img, reduced_rois)
+        return [count * self.reduce * self.reduce for count in counts]
+    
+    def load_image(self, image):
+        """
+        Decode an image for analyze_image, e.g. ahead of time in another thread
+        
+        Args:
+            image: Path to image file, or the encoded file contents as bytes
+        
+        Returns:
+            Image as numpy array (BGR format), reduced by this analyzer's factor
+        """
+        if not isinstance(image, bytes):
+            return self._load_image(image, self.reduce)
+        
+        buf = np.frombuffer(image, dtype=np.uint8)
+        img = cv2.imdecode(buf, self.REDUCED_DECODE_FLAGS[self.reduce]) if buf.size else None
         if img is None:
-            raise ValueError(f"Failed to load image: {image_path}")
+            raise ValueError("Failed to decode image data")
+        return img
+    
+    @classmethod
+    def _load_image(cls, image_path, reduce=1):
+        """
+        Load an image file as a BGR numpy array
         
-        # Convert to HSV color space
-        hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+        Reads the whole file in one call and decodes it from memory, which
+        keeps the read separate from the decode (and handles any path that
+        numpy can open).
         
-        # Create mask based on HSV thresholds
-        mask = cv2.inRange(hsv, self.hsv_lower, self.hsv_upper)
+        Args:
+            image_path: Path to image file
+            reduce: Downscale factor applied by the JPEG decoder (1, 2, 4 or 8)
         
-        # Analyze each ROI
-        results = []
-        for roi in rois:
-            count = self._count_pixels_in_roi(mask, roi)
-            results.append(count)
+        Returns:
+            Image as numpy array (BGR format)
+        """
+        try:
+            buf = np.fromfile(str(image_path), dtype=np.uint8)
+        except OSError:
+            buf = None
         
-        return results
+        flags = cls.REDUCED_DECODE_FLAGS[reduce]
+        img = cv2.imdecode(buf, flags) if buf is not None and buf.size else None
+        if img is None:
+            raise ValueError(f"Failed to load image: {image_path}")
+        
+        return img
+    
+    @staticmethod
+    def _roi_list_to_array(rois):
+        """
+        Convert ROI dictionaries to an (N, 4) int32 array of [x, y, width, height]
+        
+        Args:
+            rois: List of ROI dictionaries with keys: x, y, width, height,
+                  or an array that has already been converted
+        
+        Returns:
+            numpy array of shape (N, 4), dtype int32
+        """
+        if isinstance(rois, np.ndarray):
+            return rois
+        
+        roi_array = np.asarray(
+            [[roi['x'], roi['y'], roi['width'], roi['height']] for roi in rois],
+            dtype=np.int32
+        )
+        return roi_array.reshape(-1, 4)
     
     def analyze_image_array(self, img_array, rois):
         """
@@ -99,7 +299,8 @@ class HSVAnalyzer:
         
         Args:
             img_array: Image as numpy array (BGR format)
-            rois: List of ROI dictionaries with keys: x, y, width, height
+            rois: List of ROI dictionaries with keys: x, y, width, height,
+                  or an (N, 4) int array of [x, y, width, height]
         
         Returns:
             List of pixel counts for each ROI [count1, count2, count3, count4]
@@ -107,44 +308,123 @@ class HSVAnalyzer:
         if img_array is None:
             raise ValueError("Image array is None")
         
-        # Convert to HSV color space
-        hsv = cv2.cvtColor(img_array, cv2.COLOR_BGR2HSV)
+        # Normalize the ROIs once so the per-ROI code works on plain ints
+        roi_array = self._roi_list_to_array(rois)
         
-        # Create mask based on HSV thresholds
-        mask = cv2.inRange(hsv, self.hsv_lower, self.hsv_upper)
+        # Many/overlapping ROIs: one full-frame pass with O(1) lookups per ROI
+        roi_area = int(np.prod(np.clip(roi_array[:, 2:], 0, None), axis=1, dtype=np.int64).sum())
+        frame_area = img_array.shape[0] * img_array.shape[1]
+        if roi_area > self.INTEGRAL_AREA_RATIO * frame_area:
+            return self.count_rois_integral(img_array, roi_array)
         
-        # Analyze each ROI
+        # Analyze each ROI (HSV conversion happens per ROI, see _count_pixels_in_roi)
         results = []
-        for roi in rois:
-            count = self._count_pixels_in_roi(mask, roi)
+        for roi in roi_array.tolist():
+            count = self._count_pixels_in_roi(img_array, roi)
             results.append(count)
         
         return results
     
-    def _count_pixels_in_roi(self, mask, roi):
+    def count_rois_integral(self, img_array, rois):
         """
-        Count white pixels (matched color) in ROI region
+        Count matching pixels for many ROIs using one mask and an integral image
+        
+        The HSV mask is computed once for the whole frame and summed into an
+        integral image, after which each ROI count is four lookups. This
+        pays off when there are many or overlapping ROIs (e.g. scanning
+        windows during calibration); analyze_image_array switches to it
+        automatically above INTEGRAL_AREA_RATIO.
         
         Args:
-            mask: Binary mask image (white = matched color, black = no match)
-            roi: Dictionary with keys: x, y, width, height
+            img_array: Image as numpy array (BGR format)
+            rois: List of ROI dictionaries with keys: x, y, width, height,
+                  or an (N, 4) int array of [x, y, width, height]
+        
+        Returns:
+            List of pixel counts for each ROI
+        """
+        roi_array = self._roi_list_to_array(rois)
+        
+        hsv = cv2.cvtColor(img_array, cv2.COLOR_BGR2HSV)
+        mask = cv2.inRange(hsv, self._lower_tuple, self._upper_tuple)
+        
+        # 0/255 -> 0/1 so the integral holds pixel counts (fits in int32)
+        np.bitwise_and(mask, 1, out=mask)
+        integral = cv2.integral(mask, sdepth=cv2.CV_32S)
+        
+        height, width = mask.shape
+        results = []
+        for x, y, w, h in roi_array.tolist():
+            # Same bounds handling as slicing mask[y:y+h, x:x+w]
+            y0, y1, _ = slice(y, y + h).indices(height)
+            x0, x1, _ = slice(x, x + w).indices(width)
+            if y1 <= y0 or x1 <= x0:
+                results.append(0)
+                continue
+            
+            count = (integral[y1, x1] - integral[y0, x1]
+                     - integral[y1, x0] + integral[y0, x0])
+            results.append(int(count))
+        
+        return results
+    
+    def _count_pixels_in_roi(self, img_array, roi):
+        """
+        Count pixels matching the HSV threshold in ROI region
+        
+        The ROI is cropped from the BGR image before the HSV conversion and
+        thresholding, so only the pixels inside the ROI are processed instead
+        of the full frame (the ROIs typically cover a few percent of it).
+        
+        Args:
+            img_array: Image as numpy array (BGR format)
+            roi: Sequence of ints (x, y, width, height)
         
         Returns:
             int: Number of pixels matching the HSV threshold in this ROI
         """
-        x = int(roi['x'])
-        y = int(roi['y'])
-        w = int(roi['width'])
-        h = int(roi['height'])
+        x, y, w, h = roi
+        
+        # Extract ROI from image
+        roi_img = img_array[y:y+h, x:x+w]
+        if roi_img.size == 0:
+            return 0
+        
+        # Optional fused single-pass kernel (no HSV image or mask allocated)
+        if self.use_numba:
+            return int(_count_hsv_in_range(roi_img, self.hsv_lower, self.hsv_upper,
+                                           not self._hue_is_full,
+                                           _SDIV_TABLE, _HDIV_TABLE))
         
-        # Extract ROI from mask
-        roi_mask = mask[y:y+h, x:x+w]
+        if self.use_opencl:
+            return self._count_roi_opencl(roi_img)
         
-        # Count white pixels (value 255)
+        # Convert only the ROI to HSV and create mask based on HSV thresholds
+        roi_hsv = cv2.cvtColor(roi_img, cv2.COLOR_BGR2HSV)
+        roi_mask = cv2.inRange(roi_hsv, self._lower_tuple, self._upper_tuple)
+        
+        # Count white pixels (value 255). cv2.countNonZero measured faster
+        # than np.count_nonzero for both stream- and capture-sized ROIs
         pixel_count = cv2.countNonZero(roi_mask)
         
         return pixel_count
     
+    def _count_roi_opencl(self, roi_img):
+        """
+        Count in-range pixels of an ROI crop on the OpenCL device
+        The crop is uploaded as a UMat and only the count comes back. OpenCV's
+        use-OpenCL flag is per thread, so it is set for these calls and then
+        restored to whatever the calling thread had
+        """
+        previous = cv2.ocl.useOpenCL()
+        cv2.ocl.setUseOpenCL(True)
+        try:
+            roi_hsv = cv2.cvtColor(cv2.UMat(roi_img), cv2.COLOR_BGR2HSV)
+            roi_mask = cv2.inRange(roi_hsv, self._lower_tuple, self._upper_tuple)
+            return cv2.countNonZero(roi_mask)
+        finally:
+            cv2.ocl.setUseOpenCL(previous)
+    
     def analyze_3_captures(self, image_paths, rois):
         """
         Analyze 3 images and return averaged results
@@ -156,20 +436,17 @@ class HSVAnalyzer:
         Returns:
             List of averaged pixel counts for each ROI
         """
-        all_results = []
-        
-        for img_path in image_paths:
-            results = self.analyze_image(img_path, rois)
-            all_results.append(results)
+        roi_array = self._roi_list_to_array(rois)
         
-        # Average the results
-        num_rois = len(all_results[0])
-        averaged = []
+        # Load and analyze the captures concurrently; file reads, the OpenCV
+        # decode/HSV kernels and the Numba kernel release the GIL
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            all_results = list(executor.map(
+                lambda img_path: self.analyze_image(img_path, roi_array), image_paths))
         
-        for i in range(num_rois):
-            sum_count = sum(result[i] for result in all_results)
-            avg_count = round(sum_count / len(all_results))
-            averaged.append(avg_count)
+        # Average the results (rows = captures, columns = ROIs)
+        counts = np.asarray(all_results, dtype=np.int64)
+        averaged = np.rint(counts.mean(axis=0)).astype(int).tolist()
         
         return averaged
     
@@ -196,34 +473,35 @@ class HSVAnalyzer:
             output_path: Path to save debug image
         """
         # Load image
-        img = cv2.imread(str(image_path))
+        img = self._load_image(image_path)
         hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
         
         # Create mask
         mask = cv2.inRange(hsv, self.hsv_lower, self.hsv_upper)
         
-        # Convert mask to 3-channel for visualization
-        mask_colored = cv2.cvtColor(mask, cv2.COLOR_GRAY2BGR)
+        # Reuse one side-by-side canvas (original | mask) across calls instead
+        # of allocating a 3-channel mask copy and an hstack result each time
+        height, width = img.shape[:2]
+        if self._debug_canvas is None or self._debug_canvas.shape != (height, 2 * width, 3):
+            self._debug_canvas = np.empty((height, 2 * width, 3), dtype=np.uint8)
+        canvas = self._debug_canvas
+        img_half = canvas[:, :width]
+        mask_half = canvas[:, width:]
+        img_half[...] = img
+        mask_half[...] = mask[..., None]
         
         # Draw ROIs on both original and mask
-        for i, roi in enumerate(rois):
-            x, y, w, h = int(roi['x']), int(roi['y']), int(roi['width']), int(roi['height'])
-            
-            # Draw rectangle
-            cv2.rectangle(img, (x, y), (x + w, y + h), (0, 255, 0), 2)
-            cv2.rectangle(mask_colored, (x, y), (x + w, y + h), (0, 255, 0), 2)
-            
-            # Add label
-            cv2.putText(img, f'ROI {i+1}', (x, y-5), 
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
-            cv2.putText(mask_colored, f'ROI {i+1}', (x, y-5), 
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
-        
-        # Combine images side by side
-        combined = np.hstack([img, mask_colored])
+        for i, (x, y, w, h) in enumerate(self._roi_list_to_array(rois).tolist()):
+            for half in (img_half, mask_half):
+                # Draw rectangle
+                cv2.rectangle(half, (x, y), (x + w, y + h), (0, 255, 0), 2)
+                
+                # Add label
+                cv2.putText(half, f'ROI {i+1}', (x, y-5), 
+                           cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
         
         # Save
-        cv2.imwrite(str(output_path), combined)
+        cv2.imwrite(str(output_path), canvas)
         print(f"Debug image saved to: {output_path}")
 
 
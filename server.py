@@ -4,16 +4,31 @@ Raspberry Pi Test Strip Analyzer - Flask Backend
 Simple and reliable camera streaming and capture
 """
 
+import atexit
+import errno
+import functools
+import gzip
 import os
+import platform
+import re
+import select
+import shutil
+import signal
 import subprocess
+import threading
 import time
 import json
 import logging
+import logging.handlers
+import queue
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 from flask import Flask, Response, jsonify, send_from_directory, request
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 import base64
+import numpy as np
 from hsv_analyzer import HSVAnalyzer
 
 # Try to import RPi.GPIO for PWM control
@@ -25,43 +40,92 @@ except ImportError:
     logger = logging.getLogger('RPiAnalyzer')
     logger.warning("RPi.GPIO not available - PWM control disabled. This is normal if not running on a Raspberry Pi.")
 
+# Try to import orjson for faster JSON responses
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """JSON provider that serializes with orjson, honouring sort_keys/compact"""
+
+    def _options(self, pretty=False):
+        # Datetimes go through default() so they keep Flask's HTTP date format
+        option = (orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+                  | orjson.OPT_PASSTHROUGH_DATETIME)
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if pretty:
+            option |= orjson.OPT_INDENT_2
+        return option
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=self._options()).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        pretty = (self.compact is None and self._app.debug) or self.compact is False
+        data = orjson.dumps(obj, default=self.default, option=self._options(pretty))
+        return self._app.response_class(data, mimetype=self.mimetype)
+
+
 app = Flask(__name__, static_folder='static', static_url_path='')
+if ORJSON_AVAILABLE:
+    app.json = OrjsonProvider(app)
+app.json.compact = True  # No pretty-printing, even in debug mode
+app.json.sort_keys = False
 CORS(app)
 
 # Configuration
+VERSION = '1.0.3'
+PLATFORM_NAME = platform.system()
 STREAM_WIDTH = 406
 STREAM_HEIGHT = 304
+STREAM_JPEG_QUALITY = 50  # Live view only; captures for analysis use rpicam-still's default
 CAPTURE_WIDTH = 4056  # Native camera resolution
 CAPTURE_HEIGHT = 3040
+# Stream from the 2x2 binned sensor mode: the full field of view, like the
+# captures (so ROIs scale correctly), at a quarter of the pixels to read out
+STREAM_SENSOR_MODE = f'{CAPTURE_WIDTH // 2}:{CAPTURE_HEIGHT // 2}:12:P'
 PHOTOS_DIR = Path('photos')
-CAPTURE_DIR = Path('/tmp/captures')
+CAPTURE_STAGING_DIR = Path('/dev/shm/rpi_uv')  # tmpfs (RAM) that sequences are captured into
+CAPTURE_STAGING_BYTES_PER_PHOTO = 20 * 1024 * 1024  # Free space required per photo
 
 # Coordinate scaling factors for ROI mapping
 SCALE_FACTOR_X = CAPTURE_WIDTH / STREAM_WIDTH   # ~9.99
 SCALE_FACTOR_Y = CAPTURE_HEIGHT / STREAM_HEIGHT  # 10.0
+ROI_SCALE = np.array([SCALE_FACTOR_X, SCALE_FACTOR_Y, SCALE_FACTOR_X, SCALE_FACTOR_Y])
 
 # Create directories
 PHOTOS_DIR.mkdir(exist_ok=True)
-CAPTURE_DIR.mkdir(exist_ok=True)
 LOG_DIR = Path('logs')
 LOG_DIR.mkdir(exist_ok=True)
 
 # Set up logging
-# Uncomment the lines below to enable file logging to logs/rpi_analyzer.log
-# logging.basicConfig(
-#     level=logging.INFO,
-#     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-#     handlers=[
-#         logging.FileHandler(LOG_DIR / 'rpi_analyzer.log'),
-#         logging.StreamHandler()
-#     ]
-# )
+# Log records are queued and written by a background thread, so request
+# threads never wait on console (or file) output
+# To enable file logging to logs/rpi_analyzer.log, add
+# logging.FileHandler(LOG_DIR / 'rpi_analyzer.log') to log_handlers
 # For now, only console logging is enabled
+# (records arrive already formatted by the QueueHandler)
+log_handlers = [
+    logging.StreamHandler()
+]
+log_queue = queue.SimpleQueue()
+log_listener = logging.handlers.QueueListener(log_queue, *log_handlers)
+log_listener.start()
+atexit.register(log_listener.stop)  # Write out whatever is still queued on exit
+
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     handlers=[
-        logging.StreamHandler()
+        logging.handlers.QueueHandler(log_queue)
     ]
 )
 logger = logging.getLogger('RPiAnalyzer')
@@ -69,11 +133,65 @@ logger = logging.getLogger('RPiAnalyzer')
 # Simple global state
 streaming_active = False
 capture_in_progress = False
-mjpeg_process = None
+camera_lock = threading.Lock()  # Held for the whole of a capture sequence
 
 # Configuration file path
 CONFIG_FILE = Path('config.json')
 
+# In-memory copy of config.json, reused while the file's mtime is unchanged
+config_cache = {'mtime_ns': None, 'data': None}
+
+# Config writes are deferred and coalesced so rapid updates cost one write
+CONFIG_SAVE_DELAY = 0.5  # Seconds
+config_save_timer = None  # Pending write-behind timer, None when config.json is current
+
+# Guards the config cache and save timer. Updates build a new dict under the lock
+# instead of mutating the cached one, so readers can use a config without locking
+CFG_LOCK = threading.RLock()
+
+# MJPEG stream parsing
+MJPEG_READ_SIZE = 65536  # Bytes per read from rpicam-vid stdout
+JPEG_SOI = b'\xff\xd8'  # JPEG start of image marker
+JPEG_EOI = b'\xff\xd9'  # JPEG end of image marker
+MJPEG_FRAME_HEADER = b'--frame\r\nContent-Type: image/jpeg\r\n\r\n'
+FRAME_ETAG_PREFIX = format(time.time_ns(), 'x')  # Frame ids restart with the server, ETags must not
+
+# Camera release polling (replaces fixed sleeps after killing camera processes)
+CAMERA_PROCESS_NAMES = ('rpicam-vid', 'rpicam-still')
+CAMERA_POLL_INTERVAL = 0.05  # Seconds between /proc scans
+CAMERA_RELEASE_GRACE = 0.2  # Extra settle time once the processes are gone
+
+# Captured photos are never modified after capture, so browsers may cache them
+IMAGE_CACHE_MAX_AGE = 31536000  # One year, in seconds
+
+# Worker threads for analyzing the photos of a sequence in parallel
+# (OpenCV releases the GIL while decoding and converting images)
+ANALYSIS_EXECUTOR = ThreadPoolExecutor(max_workers=min(4, os.cpu_count() or 1))
+
+# Shared by all requests and worker threads (analyze_image keeps no per-call state)
+ANALYZER = HSVAnalyzer()
+
+# Photos of the latest capture sequence, decoded in the background while the
+# rest of the sequence is captured: photo name -> Future of the decoded image
+# A full resolution photo is ~37 MB decoded, so only the first few photos are
+# decoded ahead, and they are dropped if they aren't analyzed soon enough
+DECODED_CAPTURE_LIMIT = 2  # Photos per sequence decoded during capture
+DECODED_CAPTURE_TTL = 60  # Seconds a finished sequence's decoded photos are kept
+decoded_captures = {'folder': None, 'images': {}, 'timer': None}
+decoded_captures_lock = threading.Lock()
+
+# Buffer size for copies that can't use sendfile
+COPY_BUFFER_SIZE = 4 * 1024 * 1024
+
+# USB drives are mount points under these folders with a disk filesystem
+USB_MOUNT_BASES = ('/media', '/mnt')
+USB_FILESYSTEMS = {'vfat', 'exfat', 'ntfs', 'ntfs3', 'fuseblk', 'ext2', 'ext3', 'ext4', 'btrfs', 'xfs', 'f2fs', 'hfsplus'}
+MOUNT_ESCAPE_PATTERN = re.compile(r'\\([0-7]{3})')
+
+# USB drives found by the background watcher; None until the first scan
+usb_drives_cache = {'drives': None, 'watching': False}
+usb_drives_lock = threading.Lock()
+
 # PWM configuration
 PWM_GPIO_PIN = 12  # GPIO12 (PWM0)
 PWM_FREQUENCY = 1000  # 1 kHz
@@ -81,7 +199,7 @@ pwm_instance = None
 
 
 def load_config():
-    """Load configuration from config.json"""
+    """Load configuration from config.json (cached until the file changes)"""
     default_config = {
         "num_photos": 2,
         "startup_delay": 1.0,
@@ -97,34 +215,89 @@ def load_config():
         ]
     }
     
-    try:
-        if CONFIG_FILE.exists():
-            with open(CONFIG_FILE, 'r') as f:
-                config = json.load(f)
-                # Merge with defaults to ensure all keys exist
-                for key, value in default_config.items():
-                    if key not in config:
-                        config[key] = value
+    with CFG_LOCK:
+        try:
+            # Changes waiting for the write-behind timer are newer than the file
+            if config_save_timer is not None:
+                return config_cache['data']
+            
+            if CONFIG_FILE.exists():
+                # Return the cached config if the file hasn't changed since it was read
+                mtime_ns = CONFIG_FILE.stat().st_mtime_ns
+                if config_cache['data'] is not None and config_cache['mtime_ns'] == mtime_ns:
+                    return config_cache['data']
+                
+                with open(CONFIG_FILE, 'r') as f:
+                    config = json.load(f)
+                    # Merge with defaults to ensure all keys exist
+                    for key, value in default_config.items():
+                        if key not in config:
+                            config[key] = value
+                
+                config_cache['mtime_ns'] = mtime_ns
+                config_cache['data'] = config
                 return config
-        else:
-            # Create default config file
-            save_config(default_config)
+            else:
+                # Create default config file
+                save_config(default_config)
+                return default_config
+        except Exception as e:
+            logger.error(f"Error loading config: {e}")
             return default_config
-    except Exception as e:
-        logger.error(f"Error loading config: {e}")
-        return default_config
 
 
 def save_config(config):
-    """Save configuration to config.json"""
-    try:
-        with open(CONFIG_FILE, 'w') as f:
-            json.dump(config, f, indent=2)
-        logger.info("Configuration saved")
-        return True
-    except Exception as e:
-        logger.error(f"Error saving config: {e}")
-        return False
+    """
+    Save configuration to config.json
+    The in-memory config is updated immediately; the file is written after
+    CONFIG_SAVE_DELAY, and saves within that window are merged into one write
+    The write happens after the caller has returned, so a failed write is only
+    logged (by flush_config)
+    """
+    global config_save_timer
+    
+    with CFG_LOCK:
+        config_cache['data'] = config
+        if config_save_timer is not None:
+            config_save_timer.cancel()
+        config_save_timer = threading.Timer(CONFIG_SAVE_DELAY, flush_config)
+        config_save_timer.start()
+
+
+def flush_config():
+    """Write pending configuration changes to config.json now"""
+    global config_save_timer
+    
+    with CFG_LOCK:
+        if config_save_timer is None:
+            return True
+        config_save_timer.cancel()
+        config_save_timer = None
+        
+        try:
+            # Write to a temp file and rename it over config.json, so a crash
+            # or power loss never leaves a half-written config behind
+            tmp_path = CONFIG_FILE.with_suffix('.json.tmp')
+            with open(tmp_path, 'w') as f:
+                json.dump(config_cache['data'], f, indent=2)
+                f.flush()
+                os.fsync(f.fileno())  # Data must be on disk before the rename
+            os.replace(tmp_path, CONFIG_FILE)
+            
+            # Persist the rename itself
+            dir_fd = os.open(CONFIG_FILE.parent, os.O_RDONLY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+            
+            # Keep the cache in sync so the next load_config doesn't re-read the file
+            config_cache['mtime_ns'] = CONFIG_FILE.stat().st_mtime_ns
+            logger.info("Configuration saved")
+            return True
+        except Exception as e:
+            logger.error(f"Error saving config: {e}")
+            return False
 
 
 def init_pwm(duty_cycle=60):
@@ -135,6 +308,10 @@ def init_pwm(duty_cycle=60):
         logger.warning("GPIO not available, skipping PWM initialization")
         return False
     
+    # Only set up the pin once per process
+    if pwm_instance is not None:
+        return True
+    
     try:
         # Disable warnings for channels already in use
         GPIO.setwarnings(False)
@@ -195,33 +372,26 @@ if GPIO_AVAILABLE:
     init_pwm(app_config.get('pwm_duty_cycle', 60))
 
 
-def stream_capture(output_path, timeout_ms=500):
+def run_camera_command(cmd, timeout):
     """
-    Fast camera capture for streaming - lower resolution, balanced timeout
-    Returns True if successful, False otherwise
+    Run a camera command to completion and return (returncode, stderr)
+    stdout is discarded since photos are written to files. On timeout the
+    whole process group is killed, so a helper that keeps stderr open can't
+    hang the wait (as it can with subprocess.run)
     """
-    try:
-        cmd = [
-            'rpicam-still',
-            '-o', str(output_path),
-            '--width', str(STREAM_WIDTH),
-            '--height', str(STREAM_HEIGHT),
-            '--timeout', str(timeout_ms),
-            '--nopreview',
-            '-n',
-            '--rotation', '0'      # Force no rotation to prevent orientation issues
-        ]
-        
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=5)
-        
-        if result.returncode == 0 and output_path.exists():
-            return True
-        else:
-            return False
-            
-    except Exception as e:
-        logger.error(f"Stream capture error: {e}")
-        return False
+    with subprocess.Popen(
+        cmd,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+        start_new_session=True
+    ) as process:
+        try:
+            _, stderr = process.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            stop_process(process)
+            raise
+    return process.returncode, stderr
 
 
 def analysis_capture(output_path, timeout_ms=2000, camera_command=None):
@@ -234,7 +404,7 @@ def analysis_capture(output_path, timeout_ms=2000, camera_command=None):
         
         # Use configured camera command if not provided
         if camera_command is None:
-            camera_command = app_config.get('camera_command', 'rpicam-still')
+            camera_command = load_config().get('camera_command', 'rpicam-still')
         
         # Build command - split the camera_command in case it has arguments
         cmd_parts = camera_command.split()
@@ -246,13 +416,13 @@ def analysis_capture(output_path, timeout_ms=2000, camera_command=None):
             '-n'
         ]
         
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=10)
+        returncode, stderr = run_camera_command(cmd, timeout=10)
         
-        if result.returncode == 0 and output_path.exists():
+        if returncode == 0 and output_path.exists():
             logger.info(f"Capture successful")
             return True
         else:
-            logger.error(f"Capture failed: {result.stderr}")
+            logger.error(f"Capture failed: {stderr}")
             return False
             
     except Exception as e:
@@ -260,143 +430,687 @@ def analysis_capture(output_path, timeout_ms=2000, camera_command=None):
         return False
 
 
-def find_usb_drives():
-    """Find mounted USB drives"""
+def remove_stale_staging_dirs():
+    """
+    Remove staging folders left behind by a sequence that never finished
+    (e.g. the server was killed mid-capture), so they don't keep using RAM
+    Only call while holding camera_lock, no sequence is running then
+    """
+    for entry in os.scandir(CAPTURE_STAGING_DIR):
+        if entry.is_dir(follow_symlinks=False):
+            logger.warning(f"Removing stale staging folder: {entry.path}")
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+
+def create_staging_dir(timestamp, num_photos):
+    """
+    Create a folder in RAM (tmpfs) to capture a sequence into
+    Keeps slow SD card writes from stalling the sequence; returns None if
+    tmpfs isn't available or doesn't have room, so photos go straight to disk
+    """
+    try:
+        CAPTURE_STAGING_DIR.mkdir(parents=True, exist_ok=True)
+        remove_stale_staging_dirs()
+        stats = os.statvfs(CAPTURE_STAGING_DIR)
+        if stats.f_bavail * stats.f_frsize < num_photos * CAPTURE_STAGING_BYTES_PER_PHOTO:
+            logger.warning(f"Not enough free space in {CAPTURE_STAGING_DIR}, capturing directly to disk")
+            return None
+        
+        staging_dir = CAPTURE_STAGING_DIR / timestamp
+        staging_dir.mkdir(exist_ok=True)
+        return staging_dir
+    except OSError as e:
+        logger.warning(f"Cannot use {CAPTURE_STAGING_DIR} ({e}), capturing directly to disk")
+        return None
+
+
+def move_staged_photos(staging_dir, folder_path):
+    """Move captured photos from the RAM staging folder into their final folder"""
+    for entry in os.scandir(staging_dir):
+        shutil.move(entry.path, folder_path / entry.name)
+    staging_dir.rmdir()
+
+
+def start_decoded_captures(folder):
+    """Start collecting background decodes for a new sequence, dropping the previous one"""
+    with decoded_captures_lock:
+        if decoded_captures['timer'] is not None:
+            decoded_captures['timer'].cancel()
+        decoded_captures['folder'] = folder
+        decoded_captures['images'] = {}
+        decoded_captures['timer'] = None
+
+
+def clear_decoded_captures(folder):
+    """Drop the decoded photos of a sequence (if it is still the latest one)"""
+    with decoded_captures_lock:
+        if decoded_captures['folder'] != folder:
+            return
+        if decoded_captures['timer'] is not None:
+            decoded_captures['timer'].cancel()
+        decoded_captures['folder'] = None
+        decoded_captures['images'] = {}
+        decoded_captures['timer'] = None
+
+
+def expire_decoded_captures(folder):
+    """Drop the decoded photos of a finished sequence after DECODED_CAPTURE_TTL"""
+    timer = threading.Timer(DECODED_CAPTURE_TTL, clear_decoded_captures, args=(folder,))
+    timer.daemon = True
+    with decoded_captures_lock:
+        if decoded_captures['folder'] != folder:
+            return
+        if decoded_captures['timer'] is not None:
+            decoded_captures['timer'].cancel()
+        decoded_captures['timer'] = timer
+    timer.start()
+
+
+def decode_capture_in_background(folder, photo_name, photo_path):
+    """Start decoding a captured photo so analyze_sequence doesn't have to wait for it"""
+    with decoded_captures_lock:
+        if decoded_captures['folder'] != folder or len(decoded_captures['images']) >= DECODED_CAPTURE_LIMIT:
+            return  # analyze_sequence reads this one from disk
+    
+    try:
+        # Read now, the staged file is moved once the sequence is done
+        data = photo_path.read_bytes()
+    except OSError as e:
+        logger.warning(f"Could not read {photo_path} for background decoding: {e}")
+        return
+    
+    future = ANALYSIS_EXECUTOR.submit(ANALYZER.load_image, data)
+    with decoded_captures_lock:
+        if decoded_captures['folder'] == folder:
+            decoded_captures['images'][photo_name] = future
+
+
+def take_decoded_capture(folder, photo_name):
+    """Return (once) the Future of a photo decoded during capture, or None"""
+    with decoded_captures_lock:
+        if decoded_captures['folder'] != folder:
+            return None
+        return decoded_captures['images'].pop(photo_name, None)
+
+
+def wait_for_jpeg(path, timeout, process=None):
+    """
+    Wait until the camera has finished writing a JPEG file
+    Returns True once the file ends with the JPEG end marker and stops growing
+    """
+    deadline = time.monotonic() + timeout
+    last_size = -1
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            return False  # Camera process exited
+        try:
+            size = path.stat().st_size
+            if size > 2 and size == last_size:
+                with open(path, 'rb') as f:
+                    f.seek(-2, os.SEEK_END)
+                    if f.read(2) == JPEG_EOI:
+                        return True
+            last_size = size
+        except FileNotFoundError:
+            pass
+        time.sleep(CAMERA_POLL_INTERVAL)
+    return False
+
+
+class StillCaptureProcess:
+    """
+    Keeps one rpicam-still process running for a whole capture sequence
+    Each photo is triggered by a keypress on stdin, so the camera starts once
+    and exposure stays settled between photos. (Keypresses are used rather than
+    SIGUSR1 because rpicam-still only installs its signal handler after the
+    camera has started, so an early SIGUSR1 would kill it.)
+    """
+    
+    def __init__(self, output_pattern, camera_command='rpicam-still', settle_ms=2000):
+        cmd = camera_command.split() + [
+            '-o', str(output_pattern),  # e.g. name_%03d.jpg, numbered per capture
+            '--framestart', '1',
+            '--timeout', '0',  # Run until told to quit
+            '--keypress',
+            '--nopreview',
+            '-n'
+        ]
+        self.process = subprocess.Popen(
+            cmd,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True
+        )
+        # Give auto exposure/white balance the same settle time as a single capture
+        self.ready_at = time.monotonic() + settle_ms / 1000
+        logger.info(f"Started persistent capture process: {' '.join(cmd)}")
+    
+    def wait_ready(self):
+        """Wait until the settle time after start-up has passed"""
+        delay = self.ready_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+    
+    def capture(self, output_path, timeout=5.0):
+        """Trigger one photo and wait for it to be written to output_path"""
+        self.wait_ready()
+        
+        try:
+            self.process.stdin.write(b'\n')
+            self.process.stdin.flush()
+        except OSError:
+            return False  # Process already exited
+        
+        return wait_for_jpeg(output_path, timeout, self.process)
+    
+    def close(self):
+        """Ask rpicam-still to quit, killing it if it doesn't"""
+        try:
+            self.process.stdin.write(b'x\n')
+            self.process.stdin.close()
+            self.process.wait(timeout=2)
+        except Exception:
+            stop_process(self.process)
+
+
+def find_camera_processes(names=CAMERA_PROCESS_NAMES):
+    """
+    Scan /proc for live camera processes
+    Yields (pid, name) for each process whose name is in names
+    """
+    try:
+        proc_dirs = list(Path('/proc').iterdir())
+    except OSError:
+        return  # No /proc (not running on Linux)
+    
+    for proc_dir in proc_dirs:
+        if not proc_dir.name.isdigit():
+            continue
+        try:
+            stat = (proc_dir / 'stat').read_text()
+        except OSError:
+            continue  # Process exited while scanning
+        # Format is "pid (comm) state ..."; comm may itself contain spaces
+        comm_end = stat.rfind(')')
+        comm = stat[stat.find('(') + 1:comm_end]
+        state = stat[comm_end + 2:comm_end + 3]
+        # Zombies have already released the camera, they are just not reaped yet
+        if comm in names and state != 'Z':
+            yield int(proc_dir.name), comm
+
+
+def camera_process_running():
+    """Check /proc for a live rpicam-vid/rpicam-still process"""
+    return next(find_camera_processes(), None) is not None
+
+
+def kill_camera_processes(names=CAMERA_PROCESS_NAMES):
+    """SIGKILL leftover camera processes without spawning pkill"""
+    for pid, name in find_camera_processes(names):
+        try:
+            os.kill(pid, signal.SIGKILL)
+            logger.info(f"Killed leftover {name} (pid {pid})")
+        except OSError:
+            pass  # Already exited, or not ours to kill
+
+
+def stop_process(process, timeout=2):
+    """
+    Stop a subprocess started with start_new_session=True, along with any
+    helpers it forked: SIGTERM its process group, then SIGKILL if it hasn't
+    exited within timeout. The process is always reaped, so no zombie is left
+    """
+    for sig in (signal.SIGTERM, signal.SIGKILL):
+        # Once reaped, the pid (and group id) may belong to something else
+        if process.returncode is None:
+            try:
+                os.killpg(process.pid, sig)
+            except OSError:
+                pass  # Group already gone
+        try:
+            process.wait(timeout=timeout)
+            return
+        except subprocess.TimeoutExpired:
+            pass
+    logger.warning(f"Process {process.pid} did not exit after SIGKILL")
+
+
+def wait_camera_free(timeout=4.0):
+    """
+    Wait until no camera process is running, polling instead of sleeping a fixed time
+    Returns True if the camera was released before the timeout
+    """
+    deadline = time.monotonic() + timeout
+    while camera_process_running():
+        if time.monotonic() >= deadline:
+            logger.warning(f"Camera still in use after {timeout}s")
+            return False
+        time.sleep(CAMERA_POLL_INTERVAL)
+    time.sleep(CAMERA_RELEASE_GRACE)
+    return True
+
+
+def fast_copy(src, dst):
+    """
+    Copy a file and its timestamps, hard-linking when src and dst share a filesystem
+    Otherwise the data is copied inside the kernel with os.sendfile, or with a
+    large buffered copy where the destination filesystem doesn't support that
+    """
+    try:
+        os.link(src, dst)
+        return
+    except FileExistsError:
+        if os.path.samefile(src, dst):
+            return  # Already linked by an earlier save, don't truncate it
+    except OSError:
+        pass  # Different filesystem (e.g. USB) or no hard link support (FAT)
+    
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        st = os.fstat(fsrc.fileno())
+        offset = 0
+        try:
+            while offset < st.st_size:
+                sent = os.sendfile(fdst.fileno(), fsrc.fileno(), offset, st.st_size - offset)
+                if sent == 0:
+                    break
+                offset += sent
+        except OSError as e:
+            if offset or e.errno not in (errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP):
+                raise
+            # sendfile with an offset leaves fsrc's position at 0
+            shutil.copyfileobj(fsrc, fdst, COPY_BUFFER_SIZE)
+    os.utime(dst, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+
+def scan_usb_drives():
+    """
+    Find mounted, writable USB drives under /media and /mnt
+    Reads the kernel's mount table rather than writing a test file to every
+    directory, so the drives themselves are never touched
+    """
     usb_drives = []
-    for mount_base in ['/media', '/mnt']:
-        mount_path = Path(mount_base)
-        if mount_path.exists():
-            for item in mount_path.iterdir():
-                if item.is_dir() and item.name not in ['cdrom', 'floppy']:
-                    try:
-                        test_file = item / '.write_test'
-                        test_file.touch()
-                        test_file.unlink()
-                        usb_drives.append(str(item))
-                    except:
-                        pass
+    try:
+        with open('/proc/self/mounts') as f:
+            mounts = f.read().splitlines()
+    except OSError:
+        return usb_drives  # No /proc (not running on Linux)
+    
+    for line in mounts:
+        # Format is "device mount_point fstype options dump pass"
+        fields = line.split()
+        if len(fields) < 3 or fields[2] not in USB_FILESYSTEMS:
+            continue
+        # Spaces and tabs in mount points are octal escaped, e.g. "USB\040DISK"
+        mount_point = MOUNT_ESCAPE_PATTERN.sub(lambda m: chr(int(m.group(1), 8)), fields[1])
+        if not any(mount_point == base or mount_point.startswith(base + '/') for base in USB_MOUNT_BASES):
+            continue
+        # Also false for read-only mounts
+        if mount_point not in usb_drives and os.access(mount_point, os.W_OK):
+            usb_drives.append(mount_point)
+    
+    # Drives under /media (desktop automount) first, as before
+    usb_drives.sort(key=lambda path: not path.startswith('/media'))
     return usb_drives
 
 
+def refresh_usb_drives():
+    """Rescan USB drives and update the cached list"""
+    drives = scan_usb_drives()
+    with usb_drives_lock:
+        usb_drives_cache['drives'] = drives
+    logger.info(f"USB drives: {drives or 'none'}")
+
+
+def watch_usb_drives():
+    """
+    Background thread: rescan USB drives whenever something is mounted or unmounted
+    The kernel flags /proc/self/mounts with POLLPRI on every mount table change,
+    so the scan runs once per mount event instead of once per request
+    """
+    try:
+        with open('/proc/self/mounts') as mounts:
+            poller = select.poll()
+            poller.register(mounts, select.POLLPRI | select.POLLERR)
+            while True:
+                refresh_usb_drives()
+                poller.poll()  # Blocks until the mount table changes
+    except Exception as e:
+        logger.warning(f"USB watcher stopped, scanning on each request instead: {e}")
+    finally:
+        with usb_drives_lock:
+            usb_drives_cache['watching'] = False
+
+
+def start_usb_watcher():
+    """Start the USB watcher thread"""
+    with usb_drives_lock:
+        usb_drives_cache['watching'] = True
+    threading.Thread(target=watch_usb_drives, name='usb-watcher', daemon=True).start()
+
+
+def find_usb_drives():
+    """Find mounted USB drives (from the watcher's cache when it is running)"""
+    with usb_drives_lock:
+        if usb_drives_cache['watching'] and usb_drives_cache['drives'] is not None:
+            return list(usb_drives_cache['drives'])
+    return scan_usb_drives()
+
+# Keep the USB drive list up to date in the background
+start_usb_watcher()
+
+
+# Static assets. index.html links them with ?v=<mtime>, so the versioned URLs can
+# be cached long-term and still change as soon as a file is updated
+STATIC_DIR = Path(app.static_folder)
+STATIC_MAX_AGE = 604800  # One week, in seconds
+ASSET_URL_PATTERN = re.compile(r'((?:href|src)=")((?:css|js)/[^"?]+)"')
+COMPRESSIBLE_MIMETYPES = {'text/html', 'text/css', 'text/javascript', 'application/javascript'}
+index_cache = {'key': None, 'assets': (), 'html': None}
+gzip_cache = {}  # path -> (etag, gzip-compressed body), latest version of each file only
+
+
+def index_cache_key(html_path, assets):
+    """mtimes of index.html and its assets, which change whenever the rendered page would"""
+    return tuple(
+        (STATIC_DIR / path).stat().st_mtime_ns if (STATIC_DIR / path).exists() else 0
+        for path in assets
+    ) + (html_path.stat().st_mtime_ns,)
+
+
+def render_index():
+    """
+    Return index.html with a version added to each local asset URL
+    Returns (html bytes, version). Only stats the files while they are
+    unchanged; index.html is read and rebuilt when it or an asset changes
+    """
+    html_path = STATIC_DIR / 'index.html'
+    key = index_cache_key(html_path, index_cache['assets'])
+    
+    if index_cache['key'] != key:
+        html = html_path.read_text()
+        assets = tuple(path for _, path in ASSET_URL_PATTERN.findall(html))
+        key = index_cache_key(html_path, assets)
+        
+        def add_version(match):
+            asset_path = STATIC_DIR / match.group(2)
+            if not asset_path.exists():
+                return match.group(0)
+            return f'{match.group(1)}{match.group(2)}?v={asset_path.stat().st_mtime_ns}"'
+        
+        index_cache['html'] = ASSET_URL_PATTERN.sub(add_version, html).encode()
+        index_cache['assets'] = assets
+        index_cache['key'] = key
+    
+    return index_cache['html'], '-'.join(map(str, key))
+
+
 @app.route('/')
 def index():
-    return send_from_directory('static', 'index.html')
+    html, version = render_index()
+    response = Response(html, mimetype='text/html')
+    response.set_etag(version)
+    response.headers['Cache-Control'] = 'no-cache'  # Always revalidate, 304 if unchanged
+    return response.make_conditional(request)
+
+
+@app.after_request
+def optimize_static_response(response):
+    """Add cache headers to static files and gzip text assets for clients that accept it"""
+    if request.endpoint not in ('static', 'index'):
+        return response
+    
+    if request.endpoint == 'static' and request.args.get('v'):
+        response.headers['Cache-Control'] = f'public, max-age={STATIC_MAX_AGE}, immutable'
+    
+    response.vary.add('Accept-Encoding')
+    etag, _ = response.get_etag()
+    if (response.status_code != 200 or etag is None
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES
+            or not request.accept_encodings['gzip']):
+        return response
+    
+    # Compress each file version once and serve the cached bytes afterwards
+    source = response.response
+    cached_etag, body = gzip_cache.get(request.path, (None, None))
+    if cached_etag != etag:
+        response.direct_passthrough = False
+        body = gzip.compress(response.get_data(), compresslevel=9, mtime=0)
+        gzip_cache[request.path] = (etag, body)
+    
+    # Release the uncompressed file
+    if hasattr(source, 'close'):
+        source.close()
+    response.set_data(body)
+    response.headers['Content-Encoding'] = 'gzip'
+    # Weak ETag: same content, different encoding, still matches If-None-Match
+    response.set_etag(etag, weak=True)
+    return response
 
 
 @app.route('/api/stream/start', methods=['POST'])
 def start_stream():
     global streaming_active
     streaming_active = True
+    mjpeg_broker.start()
     logger.info("Streaming started")
     return jsonify({'status': 'streaming'})
 
 
 @app.route('/api/stream/stop', methods=['POST'])
 def stop_stream():
-    global streaming_active, mjpeg_process
+    global streaming_active
     streaming_active = False
     
-    # Kill MJPEG process if running
-    if mjpeg_process:
-        try:
-            mjpeg_process.terminate()
-            mjpeg_process.wait(timeout=2)
-        except:
-            try:
-                mjpeg_process.kill()
-            except:
-                pass
-        mjpeg_process = None
+    # Stop the shared rpicam-vid process
+    mjpeg_broker.stop()
     
     # Also kill any stray rpicam-vid processes
-    try:
-        subprocess.run(['pkill', '-9', 'rpicam-vid'], capture_output=True)
-    except:
-        pass
+    kill_camera_processes(('rpicam-vid',))
     
     logger.info("Streaming stopped")
     time.sleep(0.2)  # Brief pause
     return jsonify({'status': 'stopped'})
 
 
-def generate_mjpeg_stream():
+class MJPEGBroker:
     """
-    Generator function for MJPEG streaming using rpicam-vid
-    Yields JPEG frames continuously
+    Owns a single rpicam-vid process and shares its frames with every stream client
+    A background thread parses JPEG frames from rpicam-vid and publishes the newest
+    one through a condition variable; clients wait for the next frame, so they never
+    receive the same frame twice and never start a second camera process
     """
-    global mjpeg_process, streaming_active
     
-    try:
-        # Start rpicam-vid process for continuous JPEG streaming
-        cmd = [
-            'rpicam-vid',
-            '--width', str(STREAM_WIDTH),
-            '--height', str(STREAM_HEIGHT),
-            '--timeout', '0',  # Run indefinitely
-            '--nopreview',
-            '--codec', 'mjpeg',
-            '--inline',
-            '--flush',
-            '--framerate', '15',  # Limit framerate to reduce memory usage
-            '--rotation', '0',
-            '-o', '-'  # Output to stdout
-        ]
-        
-        mjpeg_process = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.DEVNULL,
-            bufsize=10**8
-        )
-        
-        logger.info("MJPEG stream started with rpicam-vid")
+    def __init__(self):
+        self.frame = None
+        self.part = None  # The frame wrapped as a multipart/x-mixed-replace part
+        self.frame_id = 0
+        self.cond = threading.Condition()
+        self.running = False
+        self.process = None
+        self.thread = None
+    
+    def start(self):
+        """Start the producer thread if it isn't already running"""
+        with self.cond:
+            if self.thread is not None and self.thread.is_alive():
+                return
+            self.running = True
+            self.thread = threading.Thread(target=self._reader, name='mjpeg-broker', daemon=True)
+            self.thread.start()
+    
+    def stop(self):
+        """Stop rpicam-vid and wait for the producer thread to exit"""
+        with self.cond:
+            self.running = False
+            process, thread = self.process, self.thread
+            self.cond.notify_all()
         
-        # Read and yield JPEG frames
-        while streaming_active and mjpeg_process and mjpeg_process.poll() is None:
-            # Read frame header (look for JPEG start marker)
-            chunk = mjpeg_process.stdout.read(2)
-            if not chunk or len(chunk) != 2:
-                break
+        if process is not None:
+            stop_process(process)
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout=2)
+    
+    def is_running(self):
+        """Check if the producer thread is alive"""
+        thread = self.thread
+        return thread is not None and thread.is_alive()
+    
+    def latest_frame(self):
+        """Return (frame_id, frame) for the newest JPEG frame; frame is None if there isn't one"""
+        with self.cond:
+            return self.frame_id, self.frame
+    
+    def wait_for_part(self, last_id, timeout=1.0):
+        """
+        Wait until a frame newer than last_id is published
+        Returns (frame_id, part) where part is the frame ready to send as one
+        multipart part; the id is unchanged on timeout or stop
+        """
+        with self.cond:
+            self.cond.wait_for(lambda: self.frame_id != last_id or not self.running, timeout)
+            return self.frame_id, self.part
+    
+    def _publish(self, frame_data):
+        # Build the multipart part once here, not once per stream client
+        part = MJPEG_FRAME_HEADER + frame_data + b'\r\n'
+        with self.cond:
+            self.frame = frame_data
+            self.part = part
+            self.frame_id += 1
+            self.cond.notify_all()
+    
+    def _reader(self):
+        """Producer thread: run rpicam-vid and publish each parsed JPEG frame"""
+        process = None
+        try:
+            # Start rpicam-vid process for continuous JPEG streaming
+            cmd = [
+                'rpicam-vid',
+                '--width', str(STREAM_WIDTH),
+                '--height', str(STREAM_HEIGHT),
+                '--mode', STREAM_SENSOR_MODE,
+                '--timeout', '0',  # Run indefinitely
+                '--nopreview',
+                '--codec', 'mjpeg',
+                '--quality', str(STREAM_JPEG_QUALITY),
+                '--inline',
+                '--flush',
+                '--framerate', '15',  # Limit framerate to reduce memory usage
+                '--rotation', '0',
+                '-o', '-'  # Output to stdout
+            ]
+            
+            process = subprocess.Popen(
+                cmd,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                bufsize=0,  # Unbuffered: reads go straight from the pipe, no 100 MB buffer
+                start_new_session=True  # Own process group, see stop_process()
+            )
+            
+            with self.cond:
+                self.process = process
+            
+            logger.info("MJPEG stream started with rpicam-vid")
             
-            # Check for JPEG start marker (0xFF 0xD8)
-            if chunk[0] == 0xFF and chunk[1] == 0xD8:
-                frame_data = chunk
+            # Read stdout in large chunks and split out JPEG frames by searching
+            # for the start/end markers (bytes.find runs in C, not per byte)
+            stdout = process.stdout
+            buffer = bytearray()
+            while self.running and process.poll() is None:
+                # An unbuffered read returns whatever is available instead of
+                # waiting for a full chunk
+                chunk = stdout.read(MJPEG_READ_SIZE)
+                if not chunk:
+                    break
+                buffer.extend(chunk)
                 
-                # Read until JPEG end marker (0xFF 0xD9)
+                # Drain anything else already waiting in the pipe, so clients
+                # get the newest frame instead of a growing backlog
+                while select.select([stdout], [], [], 0)[0]:
+                    chunk = stdout.read(MJPEG_READ_SIZE)
+                    if not chunk:
+                        break
+                    buffer.extend(chunk)
+                
+                # Only the newest complete frame is published, older ones are
+                # dropped without being copied
+                frame_span = None
+                pos = 0
                 while True:
-                    byte = mjpeg_process.stdout.read(1)
-                    if not byte:
+                    start = buffer.find(JPEG_SOI, pos)
+                    if start < 0:
+                        # Keep the last byte in case a marker is split across reads
+                        pos = max(pos, len(buffer) - 1)
                         break
-                    frame_data += byte
                     
-                    # Check for JPEG end marker
-                    if len(frame_data) >= 2 and frame_data[-2] == 0xFF and frame_data[-1] == 0xD9:
-                        # Yield complete JPEG frame
-                        yield (b'--frame\r\n'
-                               b'Content-Type: image/jpeg\r\n\r\n' + frame_data + b'\r\n')
+                    end = buffer.find(JPEG_EOI, start + 2)
+                    if end < 0:
+                        # Incomplete frame, wait for more data
+                        pos = start
                         break
-            
-            # Don't stream during capture
-            if capture_in_progress:
-                time.sleep(0.1)
+                    
+                    frame_span = (start, end + 2)
+                    pos = end + 2
                 
-    except Exception as e:
-        logger.error(f"MJPEG stream error: {e}")
-    finally:
-        if mjpeg_process:
-            mjpeg_process.terminate()
-            mjpeg_process.wait()
-            mjpeg_process = None
+                # Publish complete JPEG frame to waiting clients, copied
+                # straight out of the buffer in one step
+                if frame_span is not None:
+                    with memoryview(buffer) as view:
+                        frame_data = view[frame_span[0]:frame_span[1]].tobytes()
+                    self._publish(frame_data)
+                del buffer[:pos]
+                    
+        except Exception as e:
+            logger.error(f"MJPEG stream error: {e}")
+        finally:
+            with self.cond:
+                if self.thread is threading.current_thread():
+                    # Don't serve a stale frame once the stream has ended
+                    self.running = False
+                    self.frame = None
+                    self.part = None
+                    self.process = None
+                self.cond.notify_all()
+            if process:
+                stop_process(process)
+
+
+mjpeg_broker = MJPEGBroker()
+
+
+def generate_mjpeg_stream():
+    """
+    Generator function for MJPEG streaming
+    Yields each new JPEG frame published by the shared MJPEG broker
+    """
+    last_id = 0
+    while streaming_active:
+        frame_id, part = mjpeg_broker.wait_for_part(last_id, timeout=1.0)
+        if frame_id == last_id or part is None:
+            # Timed out; end the response if the producer has stopped
+            if not mjpeg_broker.is_running():
+                break
+            continue
+        
+        last_id = frame_id
+        # Every client yields the same bytes object, nothing is copied per client
+        yield part
 
 
 @app.route('/stream')
+@app.route('/api/stream/mjpeg')
 def video_stream():
-    """MJPEG video stream endpoint"""
+    """MJPEG video stream endpoint (multipart/x-mixed-replace, one JPEG per part)"""
     global streaming_active
     
     if not streaming_active:
         return "Stream not active", 503
     
+    # No-op if already running; restarts the producer after a capture stopped it
+    mjpeg_broker.start()
+    
     return Response(
         generate_mjpeg_stream(),
         mimetype='multipart/x-mixed-replace; boundary=frame'
@@ -405,33 +1119,45 @@ def video_stream():
 
 @app.route('/api/stream/frame', methods=['GET'])
 def get_frame():
-    """Legacy endpoint - kept for compatibility but deprecated"""
+    """
+    Legacy endpoint - kept for compatibility but deprecated
+    Returns the latest frame as base64 JSON, or as image/jpeg if the client prefers it
+    """
     global streaming_active, capture_in_progress
     
     # Don't stream during capture
     if capture_in_progress or not streaming_active:
         return jsonify({'success': False, 'error': 'Not streaming'}), 503
     
-    # Capture a frame to temp file
-    temp_path = CAPTURE_DIR / f'stream_{time.time()}.jpg'
+    # Use the newest frame from the running MJPEG stream instead of a new capture
+    frame_id, frame_data = mjpeg_broker.latest_frame()
     
-    if stream_capture(temp_path, timeout_ms=500):
-        try:
-            with open(temp_path, 'rb') as f:
-                frame_data = f.read()
-            temp_path.unlink()
-            
-            # Encode as base64
-            frame_b64 = base64.b64encode(frame_data).decode('utf-8')
-            return jsonify({
-                'success': True,
-                'image': f'data:image/jpeg;base64,{frame_b64}'
-            })
-        except Exception as e:
-            logger.error(f"Frame read error: {e}")
-            return jsonify({'success': False, 'error': str(e)}), 500
+    if frame_data is None:
+        return jsonify({'success': False, 'error': 'No frame available yet'}), 503
+    
+    # Clients that prefer an image (e.g. <img src>) get the raw JPEG: no base64
+    # or JSON encoding and a third fewer bytes. Others keep the JSON format
+    accept = request.accept_mimetypes
+    send_image = accept['image/jpeg'] > accept['application/json']
+    
+    # Pollers that already have the newest frame get a 304 instead of it again
+    etag = f"{FRAME_ETAG_PREFIX}-{frame_id}{'-jpeg' if send_image else ''}"
+    headers = {'Cache-Control': 'no-cache', 'Vary': 'Accept'}  # Stored, but always revalidated
+    if request.if_none_match.contains_weak(etag):
+        return Response(status=304, headers=dict(headers, ETag=f'"{etag}"'))
+    
+    if send_image:
+        response = Response(frame_data, mimetype='image/jpeg', headers=headers)
     else:
-        return jsonify({'success': False, 'error': 'Capture failed'}), 500
+        # Encode as base64
+        frame_b64 = base64.b64encode(frame_data).decode('utf-8')
+        response = jsonify({
+            'success': True,
+            'image': f'data:image/jpeg;base64,{frame_b64}'
+        })
+        response.headers.update(headers)
+    response.set_etag(etag)
+    return response
 
 
 @app.route('/api/capture-sequence', methods=['POST'])
@@ -441,9 +1167,12 @@ def capture_sequence():
     """
     global streaming_active, capture_in_progress
     
-    if capture_in_progress:
+    # Checking and setting a flag could let two requests through at once
+    if not camera_lock.acquire(blocking=False):
         return jsonify({'success': False, 'error': 'Capture already in progress'}), 409
     
+    still_process = None
+    
     # Stop streaming
     streaming_active = False
     capture_in_progress = True
@@ -452,19 +1181,15 @@ def capture_sequence():
         logger.info("=== Starting capture sequence ===")
         logger.info("Stopping stream and waiting for camera...")
         
-        # Wait for streaming to fully stop
-        time.sleep(1.0)
+        # Stop the MJPEG producer and wait for it to exit
+        mjpeg_broker.stop()
         
         # Kill any leftover camera processes to ensure camera is free
-        try:
-            subprocess.run(['pkill', '-9', 'rpicam-vid'], capture_output=True)
-            time.sleep(3.5)  # Critical: wait for memory to be freed
-            subprocess.run(['pkill', '-9', 'rpicam-still'], capture_output=True)
-            time.sleep(0.5)
-        except:
-            pass
+        kill_camera_processes()
         
-        logger.info("Camera should be free now")
+        # Critical: wait for the processes to exit and memory to be freed
+        if wait_camera_free(timeout=4.0):
+            logger.info("Camera is free")
         
         # Create timestamped folder
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
@@ -474,15 +1199,36 @@ def capture_sequence():
         
         photos = []
         
+        # One camera process for all 3 photos, so the sensor starts and
+        # settles once instead of per photo
+        camera_command = load_config().get('camera_command', 'rpicam-still')
+        try:
+            still_process = StillCaptureProcess(folder_path / f"{timestamp}_%03d.jpg", camera_command, settle_ms=4000)
+        except OSError as e:
+            logger.warning(f"Could not start persistent capture process: {e}")
+        
         # Capture 3 photos
         for i in range(1, 4):
             logger.info(f"Capturing photo {i}/3")
             
             photo_name = f"{timestamp}_{i:03d}.jpg"
             photo_path = folder_path / photo_name
+            if still_process is not None:
+                still_process.wait_ready()
+            shot_started = time.monotonic()
+            
+            captured = False
+            if still_process is not None:
+                captured = still_process.capture(photo_path)
+                if not captured:
+                    # Fall back to one process per photo for the rest of the sequence
+                    logger.warning("Persistent capture failed, starting the camera per photo instead")
+                    still_process.close()
+                    still_process = None
+                    wait_camera_free()
             
             # High quality capture at native resolution
-            if not analysis_capture(photo_path, timeout_ms=4000):
+            if not captured and not analysis_capture(photo_path, timeout_ms=4000):
                 logger.error(f"Failed to capture photo {i}/3")
                 capture_in_progress = False
                 streaming_active = True
@@ -494,9 +1240,12 @@ def capture_sequence():
             photos.append(photo_name)
             logger.info(f"Captured: {photo_name}")
             
-            # Delay before next capture (except after last)
+            # Delay before next capture (except after last), counted from
+            # the start of this shot
             if i < 3:
-                time.sleep(2.0)
+                remaining = 2.0 - (time.monotonic() - shot_started)
+                if remaining > 0:
+                    time.sleep(remaining)
         
         logger.info(f"=== Capture sequence complete: {len(photos)} photos ===")
         
@@ -514,13 +1263,31 @@ def capture_sequence():
             'error': f'Capture failed: {str(e)}'
         }), 500
     finally:
+        if still_process is not None:
+            still_process.close()
+        
         # Always reset flags
         capture_in_progress = False
-        time.sleep(0.5)
+        wait_camera_free(timeout=1.0)
         streaming_active = True
+        camera_lock.release()
         logger.info("Resuming stream")
 
 
+def sse_event(payload):
+    """Encode a dict as one Server-Sent Events message"""
+    return f'data: {json.dumps(payload)}\n\n'.encode()
+
+
+# Capture progress events that never change, encoded once
+SSE_CAPTURE_BUSY = sse_event({"status": "error", "message": "Capture already in progress"})
+SSE_CAPTURE_STARTING = sse_event({"status": "starting", "message": "Starting capture sequence..."})
+SSE_CAPTURE_PREPARING = sse_event({"status": "preparing", "message": "Stopping stream and preparing camera..."})
+
+# Stop proxies (e.g. nginx) and caches from holding back progress events
+SSE_HEADERS = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+
 @app.route('/api/capture-sequence-stream')
 def capture_sequence_stream():
     """
@@ -528,42 +1295,45 @@ def capture_sequence_stream():
     Number of photos is configurable via config.json
     """
     def generate():
-        global streaming_active, capture_in_progress, app_config
+        global streaming_active, capture_in_progress
         
-        if capture_in_progress:
-            yield f'data: {json.dumps({"status": "error", "message": "Capture already in progress"})}\n\n'
+        if not camera_lock.acquire(blocking=False):
+            yield SSE_CAPTURE_BUSY
             return
         
+        still_process = None
+        staging_dir = None
+        timestamp = None
+        completed = False
+        
         # Stop streaming
         streaming_active = False
         capture_in_progress = True
         
         try:
-            # Get number of photos, delays, and save location from config
-            num_photos = app_config.get('num_photos', 3)
-            startup_delay = app_config.get('startup_delay', 3.5)
-            capture_delay = app_config.get('capture_delay', 2.0)
-            save_location = app_config.get('save_location', 'photos')
-            camera_command = app_config.get('camera_command', 'rpicam-still')
-            
-            yield f'data: {json.dumps({"status": "starting", "message": "Starting capture sequence..."})}\n\n'
+            # Snapshot the config so the whole sequence uses consistent settings
+            with CFG_LOCK:
+                config = dict(load_config())
+            num_photos = config.get('num_photos', 3)
+            startup_delay = config.get('startup_delay', 3.5)
+            capture_delay = config.get('capture_delay', 2.0)
+            save_location = config.get('save_location', 'photos')
+            camera_command = config.get('camera_command', 'rpicam-still')
+            
+            yield SSE_CAPTURE_STARTING
             logger.info(f"=== Starting capture sequence ({num_photos} photos) ===")
             
-            yield f'data: {json.dumps({"status": "preparing", "message": "Stopping stream and preparing camera..."})}\n\n'
+            yield SSE_CAPTURE_PREPARING
             
-            # Wait for streaming to fully stop
-            time.sleep(1.0)
+            # Stop the MJPEG producer and wait for it to exit
+            mjpeg_broker.stop()
             
             # Kill any leftover camera processes
-            try:
-                subprocess.run(['pkill', '-9', 'rpicam-vid'], capture_output=True)
-                time.sleep(startup_delay)  # Configurable startup delay
-                subprocess.run(['pkill', '-9', 'rpicam-still'], capture_output=True)
-                time.sleep(0.5)
-            except:
-                pass
+            kill_camera_processes()
             
-            logger.info("Camera should be free now")
+            # Wait until the camera is released; startup_delay is now an upper bound
+            if wait_camera_free(timeout=max(startup_delay, 4.0)):
+                logger.info("Camera is free")
             
             # Create timestamped folder in configured save location
             timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
@@ -574,48 +1344,113 @@ def capture_sequence_stream():
             
             photos = []
             
+            # Capture into RAM and move the photos to disk once the sequence is done
+            staging_dir = create_staging_dir(timestamp, num_photos)
+            start_decoded_captures(timestamp)
+            capture_dir = staging_dir or folder_path
+            
+            # One camera process for the whole sequence, so the sensor isn't
+            # re-initialized for every photo
+            try:
+                still_process = StillCaptureProcess(capture_dir / f"{timestamp}_%03d.jpg", camera_command)
+            except OSError as e:
+                logger.warning(f"Could not start persistent capture process: {e}")
+            
             # Capture photos with progress updates
             for i in range(1, num_photos + 1):
-                yield f'data: {json.dumps({"status": "capturing", "photo": i, "total": num_photos, "message": f"Capturing photo {i}/{num_photos}..."})}\n\n'
+                yield sse_event({"status": "capturing", "photo": i, "total": num_photos, "message": f"Capturing photo {i}/{num_photos}..."})
                 logger.info(f"Capturing photo {i}/{num_photos}")
                 
                 photo_name = f"{timestamp}_{i:03d}.jpg"
-                photo_path = folder_path / photo_name
+                photo_path = capture_dir / photo_name
+                if still_process is not None:
+                    still_process.wait_ready()
+                shot_started = time.monotonic()
+                
+                captured = False
+                if still_process is not None:
+                    captured = still_process.capture(photo_path)
+                    if not captured:
+                        # Fall back to one process per photo for the rest of the sequence
+                        logger.warning("Persistent capture failed, starting the camera per photo instead")
+                        still_process.close()
+                        still_process = None
+                        wait_camera_free()
                 
                 # High quality capture at native resolution with configured command
-                if not analysis_capture(photo_path, timeout_ms=2000, camera_command=camera_command):
+                if not captured and not analysis_capture(photo_path, timeout_ms=2000, camera_command=camera_command):
                     logger.error(f"Failed to capture photo {i}/{num_photos}")
-                    yield f'data: {json.dumps({"status": "error", "message": f"Failed to capture photo {i}/{num_photos}"})}\n\n'
+                    yield sse_event({"status": "error", "message": f"Failed to capture photo {i}/{num_photos}"})
                     capture_in_progress = False
                     streaming_active = True
                     return
                 
                 photos.append(photo_name)
                 logger.info(f"Captured: {photo_name}")
+                decode_capture_in_background(timestamp, photo_name, photo_path)
                 
                 # Send success with image URL
-                yield f'data: {json.dumps({"status": "captured", "photo": i, "total": num_photos, "filename": photo_name, "folder": timestamp, "message": f"Captured photo {i}/{num_photos}"})}\n\n'
+                yield sse_event({"status": "captured", "photo": i, "total": num_photos, "filename": photo_name, "folder": timestamp, "message": f"Captured photo {i}/{num_photos}"})
                 
-                # Delay before next capture (except after last)
+                # Delay before next capture (except after last). The delay is
+                # counted from the start of this shot, so time spent waiting
+                # for the photo to be written isn't added on top of it
                 if i < num_photos:
-                    time.sleep(capture_delay)
+                    remaining = capture_delay - (time.monotonic() - shot_started)
+                    if remaining > 0:
+                        time.sleep(remaining)
+            
+            # Photos must be in their final folder before analysis is requested
+            if staging_dir is not None:
+                if still_process is not None:
+                    still_process.close()
+                    still_process = None
+                move_staged_photos(staging_dir, folder_path)
+                staging_dir = None
             
             logger.info(f"=== Capture sequence complete: {len(photos)} photos ===")
+            completed = True
+            expire_decoded_captures(timestamp)
             
             # Send completion event
-            yield f'data: {json.dumps({"status": "complete", "folder": timestamp, "photos": photos, "message": "All photos captured successfully"})}\n\n'
+            yield sse_event({"status": "complete", "folder": timestamp, "photos": photos, "message": "All photos captured successfully"})
             
         except Exception as e:
             logger.error(f"Capture sequence error: {e}", exc_info=True)
-            yield f'data: {json.dumps({"status": "error", "message": f"Capture failed: {str(e)}"})}\n\n'
+            yield sse_event({"status": "error", "message": f"Capture failed: {str(e)}"})
         finally:
+            if still_process is not None:
+                still_process.close()
+            
+            # Keep whatever was captured if the sequence failed part way
+            if staging_dir is not None:
+                try:
+                    move_staged_photos(staging_dir, folder_path)
+                except OSError as e:
+                    logger.error(f"Failed to move photos from {staging_dir}: {e}")
+            
+            # A failed sequence won't be analyzed, don't keep its decoded photos
+            if timestamp is not None and not completed:
+                clear_decoded_captures(timestamp)
+            
             # Always reset flags
             capture_in_progress = False
-            time.sleep(0.5)
+            wait_camera_free(timeout=1.0)
             streaming_active = True
+            camera_lock.release()
             logger.info("Resuming stream")
     
-    return Response(generate(), mimetype='text/event-stream')
+    return Response(generate(), mimetype='text/event-stream', headers=SSE_HEADERS)
+
+
+@functools.lru_cache(maxsize=8)
+def _scale_roi_array(roi_tuples):
+    """Scale (x, y, width, height) tuples to capture resolution, memoized per ROI set"""
+    scaled = np.asarray(roi_tuples, dtype=np.float64).reshape(-1, 4) * ROI_SCALE
+    # astype truncates toward zero, same as int()
+    roi_array = scaled.astype(np.int32)
+    roi_array.flags.writeable = False  # Shared between requests by the cache
+    return roi_array
 
 
 def scale_rois_to_capture_resolution(streaming_rois):
@@ -626,19 +1461,14 @@ def scale_rois_to_capture_resolution(streaming_rois):
         streaming_rois: List of ROI dicts with x, y, width, height in streaming coordinates
     
     Returns:
-        List of ROI dicts scaled to capture resolution
+        Read-only (N, 4) int32 array of [x, y, width, height] in capture
+        resolution, which HSVAnalyzer takes in place of a list of ROI dicts
     """
-    scaled_rois = []
-    for roi in streaming_rois:
-        scaled_roi = {
-            'x': int(roi['x'] * SCALE_FACTOR_X),
-            'y': int(roi['y'] * SCALE_FACTOR_Y),
-            'width': int(roi['width'] * SCALE_FACTOR_X),
-            'height': int(roi['height'] * SCALE_FACTOR_Y)
-        }
-        scaled_rois.append(scaled_roi)
-        logger.debug(f"Scaled ROI: {roi} -> {scaled_roi}")
-    return scaled_rois
+    roi_tuples = tuple((roi['x'], roi['y'], roi['width'], roi['height']) for roi in streaming_rois)
+    roi_array = _scale_roi_array(roi_tuples)
+    if logger.isEnabledFor(logging.DEBUG):  # Skip formatting the arrays otherwise
+        logger.debug(f"Scaled ROIs: {streaming_rois} -> {roi_array.tolist()}")
+    return roi_array
 
 
 @app.route('/api/analyze-sequence', methods=['POST'])
@@ -654,6 +1484,9 @@ def analyze_sequence():
     streaming_rois = data['rois']  # ROIs in streaming coordinates
     folder_path = PHOTOS_DIR / folder
     
+    if not photos:
+        return jsonify({'success': False, 'error': 'No photos to analyze'}), 400
+    
     if not folder_path.exists():
         return jsonify({'success': False, 'error': 'Folder not found'}), 404
     
@@ -664,29 +1497,36 @@ def analyze_sequence():
         capture_rois = scale_rois_to_capture_resolution(streaming_rois)
         logger.info(f"Scaled {len(streaming_rois)} ROIs to capture resolution")
         
-        analyzer = HSVAnalyzer()
-        all_results = []
-        
-        # Analyze each photo
-        for i, photo_name in enumerate(photos, 1):
+        # Check all photos exist before starting the analysis
+        photo_paths = []
+        for photo_name in photos:
             photo_path = folder_path / photo_name
             
             if not photo_path.exists():
                 return jsonify({'success': False, 'error': f'Photo not found: {photo_name}'}), 404
             
-            logger.info(f"Analyzing photo {i}/{len(photos)}: {photo_name}")
-            results = analyzer.analyze_image(photo_path, capture_rois)
-            all_results.append(results)
-            logger.info(f"Results: {results}")
+            photo_paths.append(photo_path)
+        
+        # Photos of the latest sequence were usually decoded while it was being
+        # captured; the others are read and decoded by analyze_image
+        sources = []
+        for photo_name, photo_path in zip(photos, photo_paths):
+            decoded = take_decoded_capture(folder, photo_name)
+            # Wait here rather than in the pool, so pool threads never wait on each other
+            sources.append(decoded.result() if decoded is not None else photo_path)
+        
+        # Analyze the photos in parallel, results stay in photo order
+        all_results = list(ANALYSIS_EXECUTOR.map(
+            lambda source: ANALYZER.analyze_image(source, capture_rois),
+            sources
+        ))
         
-        # Average the results
-        num_rois = len(streaming_rois)
-        averaged_results = []
+        for i, (photo_name, results) in enumerate(zip(photos, all_results), 1):
+            logger.info(f"Photo {i}/{len(photos)} {photo_name}: {results}")
         
-        for roi_idx in range(num_rois):
-            total = sum(result[roi_idx] for result in all_results)
-            avg = total / len(all_results)
-            averaged_results.append(round(avg))
+        # Average the results per ROI (rint rounds half to even, like round())
+        counts = np.array(all_results, dtype=np.int64).reshape(len(all_results), len(streaming_rois))
+        averaged_results = np.rint(counts.mean(axis=0)).astype(int).tolist()
         
         logger.info(f"Averaged results: {averaged_results}")
         
@@ -704,8 +1544,6 @@ def analyze_sequence():
 @app.route('/api/save-to-usb', methods=['POST'])
 def save_to_usb():
     """Save captured photos to USB with fallback to local directory"""
-    import shutil
-    
     data = request.get_json()
     
     if not data or 'folder' not in data:
@@ -718,6 +1556,10 @@ def save_to_usb():
     if not folder_path.exists():
         return jsonify({'success': False, 'error': 'Folder not found'}), 404
     
+    # List the photos once; both the USB and the backup copy use this list
+    with os.scandir(folder_path) as entries:
+        photos = [entry for entry in entries if entry.name.endswith('.jpg') and entry.is_file()]
+    
     # Try USB first
     try:
         usb_drives = find_usb_drives()
@@ -733,9 +1575,9 @@ def save_to_usb():
                 saved_files = []
                 
                 # Copy all photos
-                for photo in folder_path.glob('*.jpg'):
+                for photo in photos:
                     dest = save_dir / photo.name
-                    shutil.copy2(photo, dest)
+                    fast_copy(photo.path, dest)
                     saved_files.append(photo.name)
                     logger.info(f"Copied: {photo.name}")
                 
@@ -782,9 +1624,9 @@ def save_to_usb():
         saved_files = []
         
         # Copy all photos
-        for photo in folder_path.glob('*.jpg'):
+        for photo in photos:
             dest = save_dir / photo.name
-            shutil.copy2(photo, dest)
+            fast_copy(photo.path, dest)
             saved_files.append(photo.name)
             logger.info(f"Copied: {photo.name}")
         
@@ -833,12 +1675,22 @@ def get_image(folder, filename):
         if not folder_path.exists():
             return jsonify({'error': 'Folder not found'}), 404
         
+        # Photos of a sequence still being captured are in the RAM staging folder
+        staging_path = CAPTURE_STAGING_DIR / folder
+        if not (folder_path / filename).exists() and (staging_path / filename).exists():
+            folder_path = staging_path
+        
         image_path = folder_path / filename
         if not image_path.exists():
             return jsonify({'error': 'Image not found'}), 404
         
-        # Serve the image file
-        return send_from_directory(folder_path, filename, mimetype='image/jpeg')
+        # Serve the image file; conditional requests get a 304 instead of the file
+        response = send_from_directory(
+            folder_path, filename, mimetype='image/jpeg',
+            conditional=True, max_age=IMAGE_CACHE_MAX_AGE
+        )
+        response.headers['Cache-Control'] = f'public, max-age={IMAGE_CACHE_MAX_AGE}, immutable'
+        return response
     
     except Exception as e:
         logger.error(f"Error serving image: {e}")
@@ -848,41 +1700,39 @@ def get_image(folder, filename):
 @app.route('/api/config', methods=['GET'])
 def get_config():
     """Get current configuration"""
-    global app_config
     return jsonify({
         'success': True,
-        'config': app_config
+        'config': load_config()
     })
 
 
 @app.route('/api/config', methods=['POST'])
 def update_config():
     """Update configuration"""
-    global app_config
-    
     data = request.get_json()
     if not data:
         return jsonify({'success': False, 'error': 'No data provided'}), 400
     
     try:
-        # Update config
-        for key, value in data.items():
-            if key in ['num_photos', 'startup_delay', 'capture_delay', 'save_location', 'pwm_duty_cycle', 'camera_command', 'rois']:
-                app_config[key] = value
-        
-        # Save to file
-        if save_config(app_config):
-            # Update PWM if duty cycle changed
-            if 'pwm_duty_cycle' in data:
-                set_pwm_duty_cycle(data['pwm_duty_cycle'])
-            
-            return jsonify({
-                'success': True,
-                'message': 'Configuration updated',
-                'config': app_config
-            })
-        else:
-            return jsonify({'success': False, 'error': 'Failed to save config'}), 500
+        # Update a copy of the config so readers never see a partial update
+        with CFG_LOCK:
+            config = dict(load_config())
+            for key, value in data.items():
+                if key in ['num_photos', 'startup_delay', 'capture_delay', 'save_location', 'pwm_duty_cycle', 'camera_command', 'rois']:
+                    config[key] = value
+            
+            # Save to file (written in the background, see save_config)
+            save_config(config)
+        
+        # Update PWM if duty cycle changed
+        if 'pwm_duty_cycle' in data:
+            set_pwm_duty_cycle(data['pwm_duty_cycle'])
+        
+        return jsonify({
+            'success': True,
+            'message': 'Configuration updated',
+            'config': config
+        })
             
     except Exception as e:
         logger.error(f"Error updating config: {e}")
@@ -901,8 +1751,10 @@ def set_pwm():
     
     if set_pwm_duty_cycle(duty_cycle):
         # Update config
-        app_config['pwm_duty_cycle'] = duty_cycle
-        save_config(app_config)
+        with CFG_LOCK:
+            config = dict(load_config())
+            config['pwm_duty_cycle'] = duty_cycle
+            save_config(config)
         
         return jsonify({
             'success': True,
@@ -912,22 +1764,27 @@ def set_pwm():
         return jsonify({'success': False, 'error': 'Failed to set PWM'}), 500
 
 
+@functools.lru_cache(maxsize=None)
+def system_info_body():
+    """Encoded /api/system/info response, built once since it only changes on restart"""
+    return app.json.dumps({
+        'platform': PLATFORM_NAME,
+        'camera_available': True,
+        'gpio_available': GPIO_AVAILABLE,
+        'version': VERSION
+    }).encode()
+
+
 @app.route('/api/system/info', methods=['GET'])
 def system_info():
     """Get system information"""
-    import platform
-    return jsonify({
-        'platform': platform.system(),
-        'camera_available': True,
-        'gpio_available': GPIO_AVAILABLE,
-        'version': '1.0.3'
-    })
+    return Response(system_info_body(), mimetype='application/json')
 
 
 @app.route('/api/shutdown', methods=['POST'])
 def shutdown_server():
     """Safely shutdown the server and clean up resources"""
-    global streaming_active, mjpeg_process
+    global streaming_active
     
     logger.info("=== Shutdown requested ===")
     
@@ -935,24 +1792,11 @@ def shutdown_server():
         # Stop streaming
         streaming_active = False
         
-        # Kill MJPEG process if running
-        if mjpeg_process:
-            try:
-                mjpeg_process.terminate()
-                mjpeg_process.wait(timeout=2)
-            except:
-                try:
-                    mjpeg_process.kill()
-                except:
-                    pass
-            mjpeg_process = None
+        # Stop the MJPEG producer if running
+        mjpeg_broker.stop()
         
         # Kill any camera processes
-        try:
-            subprocess.run(['pkill', '-9', 'rpicam-vid'], capture_output=True)
-            subprocess.run(['pkill', '-9', 'rpicam-still'], capture_output=True)
-        except:
-            pass
+        kill_camera_processes()
         
         # Set PWM duty cycle to 0
         if GPIO_AVAILABLE:
@@ -962,16 +1806,24 @@ def shutdown_server():
         # Cleanup GPIO
         cleanup_pwm()
         
+        # Write any pending config changes before exiting
+        flush_config()
+        
         logger.info("Cleanup complete, shutting down Flask server...")
         
         # Shutdown Flask server
         shutdown = request.environ.get('werkzeug.server.shutdown')
-        if shutdown is None:
+        if request.environ.get('SERVER_SOFTWARE', '').startswith('gunicorn'):
+            # Under gunicorn, stop the master; exiting the worker would just respawn it
+            def delayed_shutdown():
+                time.sleep(1)
+                os.kill(os.getppid(), signal.SIGTERM)
+            threading.Thread(target=delayed_shutdown, daemon=True).start()
+        elif shutdown is None:
             # Werkzeug 2.1+ doesn't have server.shutdown, use os._exit as fallback
-            import os
-            import threading
             def delayed_shutdown():
                 time.sleep(1)
+                log_listener.stop()  # os._exit skips atexit handlers
                 os._exit(0)
             threading.Thread(target=delayed_shutdown, daemon=True).start()
         else:
@@ -986,7 +1838,7 @@ def shutdown_server():
 
 if __name__ == '__main__':
     logger.info("=" * 60)
-    logger.info("RPi Test Strip Analyzer - Server Starting (v1.0.3)")
+    logger.info(f"RPi Test Strip Analyzer - Server Starting (v{VERSION})")
     logger.info("=" * 60)
     logger.info(f"Stream resolution: {STREAM_WIDTH}x{STREAM_HEIGHT}")
     logger.info(f"Capture resolution: Native (full camera resolution)")
@@ -1003,5 +1855,8 @@ if __name__ == '__main__':
     try:
         app.run(host='0.0.0.0', port=5000, debug=False, threaded=True)
     finally:
-        # Cleanup on exit
+        # Cleanup on exit (camera processes run in their own session, so
+        # they don't get the terminal's Ctrl+C)
+        mjpeg_broker.stop()
+        flush_config()
         cleanup_pwm()
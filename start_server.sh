@@ -15,4 +15,9 @@ echo "Server will be available at http://localhost:5000"
 echo "Press Ctrl+C to stop"
 echo ""
 
-python3 server.py
+# Use gunicorn if installed (see gunicorn_conf.py), otherwise Flask's built-in server
+if command -v gunicorn &> /dev/null; then
+    gunicorn -c gunicorn_conf.py server:app
+else
+    python3 server.py
+fi